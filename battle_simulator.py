@@ -1,11 +1,22 @@
 import tkinter as tk
 from tkinter import scrolledtext, messagebox
 import pandas as pd
+import numpy as np
 import random
+import math
+import statistics
+import concurrent.futures
+import os
+import tempfile
+import time
 
 moves_df_global = None
 full_battle_log = []
 
+# Team battles always use fixed size arrays with these shapes
+TEAM_SIZE = 6
+MOVES_PER_POKEMON = 4
+
 def load_pokemon_data():
     """
     Loads the pokemon data from pokemon.csv into a dataframe and returns it
@@ -20,21 +31,156 @@ def load_moves_data():
     df = pd.read_csv('moves.csv')
     return df
 
-def find_pokemon_by_name(df, name):
+def load_data_store(pokemon_path='pokemon.csv', moves_path='moves.csv', chunksize=100000):
+    """
+    Streams the pokemon and moves CSV files in chunks of chunksize rows and builds an indexed store
+    so lookups don't have to scan the whole table every time. This is meant for really big rosters
+    (like the ones made by generate_synthetic_dataset()), the normal game still uses load_pokemon_data()
+    Returns a dictionary with:
+        "pokemon": the pokemon dataframe
+        "pokemon_index": lowercase name -> row position, used by find_pokemon_by_name()
+        "moves": the moves dataframe
+        "moves_by_type": lowercase type -> {"type": the type, "rows": row positions in "moves" of that type's moves sorted by power,
+                                            "power": the sorted powers, "accuracy": their accuracies (100 when missing)}
+                         used by get_level_proportional_moves()
+    The index only keeps row positions, not copies of the moves, so the moves are only in memory once
+
+    Documentation for:
+        Reading a CSV in chunks:
+            https://pandas.pydata.org/docs/user_guide/io.html#iterating-through-files-chunk-by-chunk
+    """
+    pokemon_chunks = []
+    pokemon_index = {}
+    offset = 0
+    # capture_rate has a few text values like "30 (Meteorite)255 (Core)", so it's read as text in every chunk
+    for chunk in pd.read_csv(pokemon_path, chunksize=chunksize, dtype={'capture_rate': str}):
+        for pos, name in enumerate(chunk['name'].astype(str).str.lower()):
+            # setdefault keeps the first Pokemon with that name, the same one find_pokemon_by_name() would find
+            pokemon_index.setdefault(name, offset + pos)
+        pokemon_chunks.append(chunk)
+        offset += len(chunk)
+
+    moves_chunks = []
+    key_chunks = []
+    offset = 0
+    for chunk in pd.read_csv(moves_path, chunksize=chunksize):
+        moves_chunks.append(chunk)
+        # Moves without a power can never be picked by get_level_proportional_moves(), so they aren't indexed
+        powered = chunk['power'].notna().to_numpy()
+        key_chunks.append(pd.DataFrame({
+            "type": chunk['type'].str.lower().to_numpy()[powered],
+            "name": chunk['name'].to_numpy()[powered],
+            "power": chunk['power'].to_numpy()[powered],
+            "accuracy": chunk['accuracy'].fillna(100).to_numpy()[powered],
+            "row": offset + np.flatnonzero(powered)
+        }))
+        offset += len(chunk)
+
+    moves_by_type = {}
+    keys = pd.concat(key_chunks, ignore_index=True).drop_duplicates(['type', 'name'])
+    for move_type, group in keys.groupby('type'):
+        group = group.sort_values('power', kind='stable')
+        moves_by_type[move_type] = {
+            "type": move_type,
+            "rows": group['row'].to_numpy(),
+            "power": group['power'].to_numpy(),
+            "accuracy": group['accuracy'].to_numpy()
+        }
+
+    return {
+        "pokemon": pd.concat(pokemon_chunks, ignore_index=True),
+        "pokemon_index": pokemon_index,
+        "moves": pd.concat(moves_chunks, ignore_index=True),
+        "moves_by_type": moves_by_type
+    }
+
+def generate_synthetic_dataset(n_pokemon, n_moves, pokemon_path, moves_path, template_pokemon_path='pokemon.csv', template_moves_path='moves.csv', chunksize=100000, seed=None):
+    """
+    Writes a made up roster of n_pokemon Pokemon and n_moves moves to pokemon_path and moves_path
+    Every new row is copied from a random row of the real CSV files so it has the same columns,
+    then it gets a new unique name and its stats (or move power) are changed by up to 25%
+    The types and the against_* columns are kept from the copied row so the type data still makes sense
+    The files are written chunksize rows at a time so millions of rows don't have to fit in memory at once
+    """
+    rng = np.random.default_rng(seed)
+    template_pokemon = pd.read_csv(template_pokemon_path)
+    template_moves = pd.read_csv(template_moves_path)
+    stat_columns = ['hp', 'attack', 'defense', 'sp_attack', 'sp_defense', 'speed']
+
+    for start in range(0, n_pokemon, chunksize):
+        size = min(chunksize, n_pokemon - start)
+        chunk = template_pokemon.iloc[rng.integers(0, len(template_pokemon), size)].reset_index(drop=True)
+        numbers = np.arange(start + 1, start + size + 1)
+        chunk['name'] = ["Synthmon" + str(number) for number in numbers]
+        chunk['japanese_name'] = chunk['name']
+        chunk['pokedex_number'] = numbers
+        for column in stat_columns:
+            scaled = chunk[column].to_numpy() * rng.uniform(0.75, 1.25, size)
+            chunk[column] = np.clip(scaled, 1, 255).astype(int)
+        chunk['base_total'] = chunk[stat_columns].sum(axis=1)
+        chunk.to_csv(pokemon_path, mode='w' if start == 0 else 'a', header=(start == 0), index=False)
+
+    for start in range(0, n_moves, chunksize):
+        size = min(chunksize, n_moves - start)
+        chunk = template_moves.iloc[rng.integers(0, len(template_moves), size)].reset_index(drop=True)
+        numbers = np.arange(start + 1, start + size + 1)
+        chunk['name'] = ["Synthetic Move " + str(number) for number in numbers]
+        chunk['id'] = numbers
+        # NaN power stays NaN, so status moves stay status moves
+        chunk['power'] = (chunk['power'] * rng.uniform(0.75, 1.25, size)).round()
+        chunk.to_csv(moves_path, mode='w' if start == 0 else 'a', header=(start == 0), index=False)
+
+def find_pokemon_by_name(df, name, pokemon_index=None):
     """
     Searches for a pokemon in the pokemon dataframe and returns the row containing the pokemon's data
     Returns None if the pokemon name given by the player doesn't exist
+    If pokemon_index from load_data_store() is given, it looks the name up directly instead of checking every row
     """
     lower_name = name.lower()
+    if pokemon_index is not None:
+        pos = pokemon_index.get(lower_name)
+        if pos is None:
+            return None
+        return df.iloc[pos]
     for index, row in df.iterrows():
         if str(row['name']).lower() == lower_name:
             return row
     return None
 
-def get_level_proportional_moves(pokemon_row, moves_df, level=15):
+def get_level_proportional_moves(pokemon_row, moves_df, level=15, moves_by_type=None):
     """
     Selects 4 moves for a pokemon to use based on its types and base stats and returns them
+    If moves_by_type from load_data_store() is given, get_indexed_moves() is used instead of filtering the whole moves table
     """
+    if moves_by_type is not None:
+        return get_indexed_moves(pokemon_row, moves_df, moves_by_type)
+    weak_moves, strong_moves = get_move_pool(pokemon_row, moves_df)
+
+    if len(weak_moves) >= 4:
+        return weak_moves.sample(4)
+    final_moves = weak_moves.copy()
+
+    if len(final_moves) < 4:
+        need = min(4 - len(final_moves), len(strong_moves))
+        if need > 0:
+            extra = strong_moves.sample(need)
+            final_moves = pd.concat([final_moves, extra])
+
+    return final_moves.head(4)
+
+def get_move_pool(pokemon_row, moves_df, moves_by_type=None):
+    """
+    Returns the (weak_moves, strong_moves) dataframes that get_level_proportional_moves() picks from:
+    it picks 4 of the weak moves, or all of them plus random strong moves when there are less than 4
+    If moves_by_type from load_data_store() is given, the pool comes from the index instead
+    """
+    if moves_by_type is not None:
+        weak, strong = get_indexed_segments(pokemon_row, moves_by_type)
+        weak_rows = [group["rows"][start:start + count] for group, start, count in weak]
+        strong_rows = [group["rows"][start:start + count] for group, start, count in strong]
+        if not weak_rows:
+            return moves_df.head(0), moves_df.head(0)
+        return moves_df.iloc[np.concatenate(weak_rows)], moves_df.iloc[np.concatenate(strong_rows)]
     type1 = str(pokemon_row['type1']).lower()
     type2 = pokemon_row['type2'] if pd.notna(pokemon_row['type2']) else None
     # Gets all of the moves that the pokemon's primary type can use
@@ -57,19 +203,73 @@ def get_level_proportional_moves(pokemon_row, moves_df, level=15):
     # This isn't what the actual pokemon games use, I only made it like this for my game.
     max_power = max(40, int(pokemon_row['base_total'] * 0.15))
     weak_moves = type_moves[type_moves['power'] <= max_power]
+    strong_moves = type_moves[type_moves['power'] > max_power]
+    return weak_moves, strong_moves
 
-    if len(weak_moves) >= 4:
-        return weak_moves.sample(4)
-    final_moves = weak_moves.copy()
+def get_indexed_moves(pokemon_row, moves_df, moves_by_type):
+    """
+    Does the same thing as get_level_proportional_moves() but uses the moves_by_type index from load_data_store()
+    Since every type's moves are sorted by power, np.searchsorted() finds where the weak moves end
+    without checking every move, and random.sample() picks positions instead of copying the weak moves
+    So it takes about the same time whether there are 800 moves or millions
+    """
+    weak, strong = get_indexed_segments(pokemon_row, moves_by_type)
 
-    if len(final_moves) < 4:
-        strong_moves = type_moves[type_moves['power'] > max_power]
-        need = min(4 - len(final_moves), len(strong_moves))
-        if need > 0:
-            extra = strong_moves.sample(need)
-            final_moves = pd.concat([final_moves, extra])
+    rows = [group["rows"][index] for group, index in pick_segment_positions(weak, strong)]
+    return moves_df.iloc[rows]
 
-    return final_moves.head(4)
+def pick_segment_positions(weak, strong, rng=random):
+    """
+    Picks up to 4 moves from weak and strong segments with the same rules as get_level_proportional_moves()
+    and returns them as (group, index) pairs. Only the picked positions are worked out, so it takes the
+    same time however many moves the segments cover
+    """
+    total_weak = sum(count for group, start, count in weak)
+    total_strong = sum(count for group, start, count in strong)
+    if total_weak >= 4:
+        return locate_segment_positions(weak, rng.sample(range(total_weak), 4))
+    picked = locate_segment_positions(weak, range(total_weak))
+    need = min(4 - total_weak, total_strong)
+    if need > 0:
+        picked += locate_segment_positions(strong, rng.sample(range(total_strong), need))
+    return picked
+
+def locate_segment_positions(segments, positions):
+    """
+    Turns positions numbered across all of the (group, start, count) segments into (group, index) pairs
+    """
+    located = []
+    for pos in positions:
+        for group, start, count in segments:
+            if pos < count:
+                located.append((group, start + pos))
+                break
+            pos -= count
+    return located
+
+def get_indexed_segments(pokemon_row, moves_by_type):
+    """
+    Finds where a Pokemon's weak and strong moves are in the moves_by_type index
+    Returns two lists (weak, strong) of (group, start, count) segments, one for each of the Pokemon's types,
+    where group is that type's entry in moves_by_type
+    """
+    type1 = str(pokemon_row['type1']).lower()
+    type2 = str(pokemon_row['type2']).lower() if pd.notna(pokemon_row['type2']) else None
+    # A Pokemon with the same type twice shouldn't get that type's moves counted twice
+    if type2 is None or type2 == type1:
+        move_types = [type1]
+    else:
+        move_types = [type1, type2]
+    groups = [moves_by_type[move_type] for move_type in move_types if move_type in moves_by_type]
+
+    max_power = max(40, int(pokemon_row['base_total'] * 0.15))
+    weak = []
+    strong = []
+    for group in groups:
+        count = int(np.searchsorted(group["power"], max_power, side='right'))
+        weak.append((group, 0, count))
+        strong.append((group, count, len(group["power"]) - count))
+    return weak, strong
 
 def get_type_multiplier(move_type, def_type):
     """
@@ -330,6 +530,491 @@ def perform_attack(battle, attacker_poke, defender_poke, move_row, is_player_tur
     update_hp_bars(battle, player_hp_bar, enemy_hp_bar, player_hp_label, enemy_hp_label, player_display_name, enemy_display_name)
     return True
 
+def simulate_battle(poke1, poke2, moves1, moves2):
+    """
+    Runs one battle between two Pokemon without any of the tkinter widgets and returns True if poke1 wins
+    Follows the same rules as create_battle_window() and perform_attack(): hp * 2, poke1 attacks first,
+    a random move is picked every turn and the accuracy is checked before the damage is calculated
+    moves1 and moves2 are lists of (power, type, accuracy) tuples made by draw_moveset()
+    """
+    hp = [int(poke1['hp']) * 2, int(poke2['hp']) * 2]
+    sides = [(poke1, poke2, moves1), (poke2, poke1, moves2)]
+    turn = 0
+    while True:
+        attacker, defender, moves = sides[turn]
+        move_power, move_type, move_accuracy = random.choice(moves)
+        if random.uniform(0, 100) <= move_accuracy:
+            hp[1 - turn] -= calculate_damage(attacker, defender, move_power, move_type, attacker['type1'])
+            if hp[1 - turn] <= 0:
+                return turn == 0
+        turn = 1 - turn
+
+def get_move_tuple_pool(pokemon_row, moves_df, moves_by_type=None):
+    """
+    Returns a Pokemon's move pool as (weak, strong) lists of (group, start, count) segments for draw_moveset()
+    With moves_by_type from load_data_store() these are just the segments from get_indexed_segments(),
+    so nothing is copied out of the index however many moves there are
+    Without it, the pool from get_move_pool() is split into one group per type with get_move_segments()
+    """
+    if moves_by_type is not None:
+        return get_indexed_segments(pokemon_row, moves_by_type)
+    weak_moves, strong_moves = get_move_pool(pokemon_row, moves_df)
+    return (get_move_segments(weak_moves), get_move_segments(strong_moves))
+
+def get_move_segments(moves):
+    """
+    Turns a moves dataframe into (group, start, count) segments, one for each type, where group has
+    the same "type", "power" and "accuracy" keys as a moves_by_type entry
+    Moves without a power count as 0 power, and moves without an accuracy count as 100 like perform_attack()
+    """
+    segments = []
+    for move_type, type_moves in moves.groupby(moves['type'].str.lower(), sort=False):
+        group = {
+            "type": move_type,
+            "power": type_moves['power'].fillna(0).to_numpy(),
+            "accuracy": type_moves['accuracy'].fillna(100).to_numpy()
+        }
+        segments.append((group, 0, len(type_moves)))
+    return segments
+
+def count_pool_moves(move_pool):
+    """
+    Returns how many moves a pool from get_move_tuple_pool() can pick from
+    """
+    weak, strong = move_pool
+    return sum(count for group, start, count in weak + strong)
+
+def draw_moveset(move_pool, rng=random):
+    """
+    Picks a moveset of (power, type, accuracy) tuples from a pool made by get_move_tuple_pool()
+    with pick_segment_positions(), so only the picked moves are looked up
+    rng can be a random.Random so the picks don't use (or change) the global random numbers
+    """
+    weak, strong = move_pool
+    return [(group["power"][index], group["type"], group["accuracy"][index])
+            for group, index in pick_segment_positions(weak, strong, rng)]
+
+def wilson_interval(wins, battles, z=1.96):
+    """
+    Returns the (low, high) Wilson score interval for a win rate
+    z=1.96 is a 95% confidence interval
+    I used this instead of the normal "p +- z * sqrt(p(1-p)/n)" interval because that one breaks
+    when a Pokemon wins every battle (it gives a width of 0), which happens a lot with lopsided matchups
+
+    Documentation for:
+        Wilson score interval:
+            https://en.wikipedia.org/wiki/Binomial_proportion_confidence_interval#Wilson_score_interval
+    """
+    if battles == 0:
+        return (0.0, 1.0)
+    p = wins / battles
+    denom = 1 + z * z / battles
+    center = (p + z * z / (2 * battles)) / denom
+    half_width = z * math.sqrt(p * (1 - p) / battles + z * z / (4 * battles * battles)) / denom
+    return (max(0.0, center - half_width), min(1.0, center + half_width))
+
+def sequential_win_rate(play_battle, precision=0.05, threshold=None, block_size=25, max_battles=1000, confidence=0.95):
+    """
+    Calls play_battle() (which returns True for a win) in blocks of block_size until max_battles, but stops as soon as:
+        the confidence interval is narrower than +- precision ("precision")
+        or the whole interval is above/below threshold, so we already know who is favored ("decided")
+    Checking the interval after every block gives it a lot more chances to be wrong than a single 95% interval,
+    so the (1 - confidence) error is split over every check (Bonferroni) and each check uses a wider z
+    That means the reported interval holds the real win rate at least confidence of the time however early it stops,
+    and "decided" picks the wrong side of threshold at most (1 - confidence) of the time
+    Returns a dictionary with the wins, battles, win rate, interval and why it stopped
+
+    Documentation for:
+        Bonferroni correction:
+            https://en.wikipedia.org/wiki/Bonferroni_correction
+        NormalDist:
+            https://docs.python.org/3/library/statistics.html#statistics.NormalDist
+    """
+    looks = math.ceil(max_battles / block_size)
+    z = statistics.NormalDist().inv_cdf(1 - (1 - confidence) / (2 * looks))
+
+    wins = 0
+    battles = 0
+    stop_reason = "max_battles"
+    while battles < max_battles:
+        block = min(block_size, max_battles - battles)
+        for i in range(block):
+            if play_battle():
+                wins += 1
+        battles += block
+
+        low, high = wilson_interval(wins, battles, z)
+        if (high - low) / 2 <= precision:
+            stop_reason = "precision"
+            break
+        if threshold is not None and (low > threshold or high < threshold):
+            stop_reason = "decided"
+            break
+
+    low, high = wilson_interval(wins, battles, z)
+    return {
+        "wins": wins,
+        "battles": battles,
+        "win_rate": wins / battles,
+        "low": low,
+        "high": high,
+        "stop_reason": stop_reason
+    }
+
+def estimate_matchup(poke1, poke2, moves_df, precision=0.05, threshold=None, block_size=25, max_battles=1000, confidence=0.95, moves_by_type=None, move_pools=None):
+    """
+    Estimates how often poke1 beats poke2 with sequential_win_rate(), so it can stop early
+    instead of always running max_battles (see sequential_win_rate() for what the interval guarantees)
+    Every battle draws new movesets for both Pokemon, the same way every battle window does,
+    so the interval covers the moveset luck too and not just one random moveset
+    moves_by_type from load_data_store() can be given to pick the moves from the index,
+    and move_pools can be given as (pool1, pool2) from get_move_tuple_pool() so they aren't rebuilt
+    Returns the dictionary from sequential_win_rate() with the two Pokemon's names added
+    """
+    if move_pools is None:
+        move_pools = (get_move_tuple_pool(poke1, moves_df, moves_by_type), get_move_tuple_pool(poke2, moves_df, moves_by_type))
+    pool1, pool2 = move_pools
+    if count_pool_moves(pool1) == 0 or count_pool_moves(pool2) == 0:
+        return None
+    # Converting the rows to dictionaries once makes calculate_damage() much faster inside the loop
+    poke1 = poke1.to_dict()
+    poke2 = poke2.to_dict()
+
+    def play_battle():
+        return simulate_battle(poke1, poke2, draw_moveset(pool1), draw_moveset(pool2))
+
+    result = {"player": poke1['name'], "enemy": poke2['name']}
+    result.update(sequential_win_rate(play_battle, precision, threshold, block_size, max_battles, confidence))
+    return result
+
+def simulate_matchup_matrix(pokemon_df, moves_df, fixed_battles=1000, **kwargs):
+    """
+    Runs estimate_matchup() for every pair of different Pokemon in pokemon_df
+    Any extra keyword arguments (precision, threshold, block_size, confidence, moves_by_type) are passed to estimate_matchup()
+    Returns a dictionary with a results dataframe and how many battles the early stopping saved
+    compared to running fixed_battles for every matchup
+    """
+    kwargs.setdefault("max_battles", fixed_battles)
+    # Every Pokemon's move pool is only built once for the whole matrix
+    move_pools = [get_move_tuple_pool(pokemon_df.iloc[i], moves_df, kwargs.get("moves_by_type")) for i in range(len(pokemon_df))]
+    results = []
+    for i in range(len(pokemon_df)):
+        for j in range(len(pokemon_df)):
+            if i == j:
+                continue
+            result = estimate_matchup(pokemon_df.iloc[i], pokemon_df.iloc[j], moves_df, move_pools=(move_pools[i], move_pools[j]), **kwargs)
+            if result is not None:
+                results.append(result)
+
+    battles_run = sum(result["battles"] for result in results)
+    battles_fixed = fixed_battles * len(results)
+    return {
+        "results": pd.DataFrame(results),
+        "battles_run": battles_run,
+        "battles_fixed": battles_fixed,
+        "battles_saved": battles_fixed - battles_run
+    }
+
+def build_team_state(team_df, moves_df, moves_by_type=None, rng=random):
+    """
+    Builds the state of one side of a team battle as fixed size numpy arrays
+    Every array has TEAM_SIZE rows (and MOVES_PER_POKEMON columns for the moves), so teams with less than
+    6 Pokemon still work, the empty slots just have 0 HP and count as fainted
+    Each member's move pool from get_move_tuple_pool() is kept in "move_pools" and a first moveset is
+    drawn with draw_team_moves(), which can be called again to give the team new moves for the next battle
+    """
+    team = {
+        "names": [""] * TEAM_SIZE,
+        "type1": np.full(TEAM_SIZE, "", dtype=object),
+        "type2": np.full(TEAM_SIZE, "", dtype=object),
+        "max_hp": np.zeros(TEAM_SIZE, dtype=int),
+        "attack": np.zeros(TEAM_SIZE),
+        "defense": np.ones(TEAM_SIZE),
+        "move_power": np.zeros((TEAM_SIZE, MOVES_PER_POKEMON)),
+        "move_type": np.full((TEAM_SIZE, MOVES_PER_POKEMON), "", dtype=object),
+        "move_accuracy": np.full((TEAM_SIZE, MOVES_PER_POKEMON), 100.0),
+        "move_count": np.zeros(TEAM_SIZE, dtype=int),
+        "move_pools": [([], [])] * TEAM_SIZE
+    }
+    for slot in range(min(TEAM_SIZE, len(team_df))):
+        poke = team_df.iloc[slot]
+        team["names"][slot] = poke['name']
+        team["type1"][slot] = str(poke['type1']).lower()
+        team["type2"][slot] = str(poke['type2']).lower() if pd.notna(poke['type2']) else ""
+        team["max_hp"][slot] = int(poke['hp']) * 2
+        team["attack"][slot] = poke['attack']
+        team["defense"][slot] = max(1, poke['defense'])
+
+        move_pool = get_move_tuple_pool(poke, moves_df, moves_by_type)
+        if count_pool_moves(move_pool) == 0:
+            # A Pokemon without any moves of its types still needs something to attack with
+            move_pool = (get_move_segments(moves_df.head(MOVES_PER_POKEMON)), [])
+        team["move_pools"][slot] = move_pool
+    draw_team_moves(team, rng)
+    return team
+
+def draw_team_moves(team, rng=random):
+    """
+    Draws a new moveset for every member of a team from build_team_state() with draw_moveset()
+    and writes it into the team's move arrays
+    """
+    for slot in range(TEAM_SIZE):
+        move_tuples = draw_moveset(team["move_pools"][slot], rng) if team["max_hp"][slot] > 0 else []
+        team["move_power"][slot, :] = 0
+        team["move_type"][slot, :] = ""
+        team["move_accuracy"][slot, :] = 100.0
+        for i, (power, move_type, accuracy) in enumerate(move_tuples):
+            team["move_power"][slot, i] = power
+            team["move_type"][slot, i] = str(move_type).lower()
+            team["move_accuracy"][slot, i] = accuracy
+        team["move_count"][slot] = len(move_tuples)
+
+def get_team_damage_table(attackers, defenders):
+    """
+    Returns an array of shape (TEAM_SIZE, MOVES_PER_POKEMON, TEAM_SIZE) with the damage every attacker's move
+    does to every defender before the random variation, using the same formula as calculate_damage()
+    This only has to be done once for two teams, then every turn is just a lookup
+    """
+    base = ((2 * 50 / 5 + 2) * attackers["attack"][:, None, None] * attackers["move_power"][:, :, None]
+            / defenders["defense"][None, None, :]) / 50 + 2
+    stab = np.where(attackers["move_type"] == attackers["type1"][:, None], 1.5, 1.0)
+    type_mult = np.ones((TEAM_SIZE, MOVES_PER_POKEMON, TEAM_SIZE))
+    for attacker in range(TEAM_SIZE):
+        for move in range(attackers["move_count"][attacker]):
+            for defender in range(TEAM_SIZE):
+                move_type = attackers["move_type"][attacker, move]
+                type_mult[attacker, move, defender] = (get_type_multiplier(move_type, defenders["type1"][defender])
+                                                       * get_type_multiplier(move_type, defenders["type2"][defender]))
+    return base * stab[:, :, None] * type_mult
+
+def get_expected_damage(team, damage_table):
+    """
+    Returns a (TEAM_SIZE, TEAM_SIZE) array with the average damage each team member does to each opponent
+    when it picks one of its moves at random, counting misses. Used to decide who to switch in
+    """
+    has_move = np.arange(MOVES_PER_POKEMON)[None, :] < team["move_count"][:, None]
+    hit_damage = damage_table * 0.925 * (team["move_accuracy"] / 100)[:, :, None] * has_move[:, :, None]
+    return hit_damage.sum(axis=1) / np.maximum(1, team["move_count"])[:, None]
+
+def simulate_team_battle(team1, team2, damage_tables=None, rng=random):
+    """
+    Runs one 6v6 battle between two teams from build_team_state() and returns True if team1 wins
+    Each turn the active Pokemon either attacks with a random move (like simulate_battle()) or switches out,
+    which uses up its turn. It switches when a healthy teammate would do more than twice as much damage
+    to the opponent's active Pokemon, but not twice in a row so two teams can't keep switching forever
+    When a Pokemon faints, the teammate that does the most damage to the attacker comes in for free
+    damage_tables can be given as (team1 vs team2, team2 vs team1) so they aren't rebuilt every battle
+    rng can be a random.Random so the battle doesn't use (or change) the global random numbers
+    """
+    teams = [team1, team2]
+    if damage_tables is None:
+        damage_tables = (get_team_damage_table(team1, team2), get_team_damage_table(team2, team1))
+    expected = [get_expected_damage(team1, damage_tables[0]), get_expected_damage(team2, damage_tables[1])]
+    hp = [team1["max_hp"].copy(), team2["max_hp"].copy()]
+    if not (hp[1] > 0).any():
+        return True
+    if not (hp[0] > 0).any():
+        return False
+    active = [int(np.argmax(hp[0] > 0)), int(np.argmax(hp[1] > 0))]
+    just_switched = [False, False]
+
+    turn = 0
+    while True:
+        team = teams[turn]
+        attacker = active[turn]
+        defender = active[1 - turn]
+        options = np.where(hp[turn] > 0, expected[turn][:, defender], -1)
+        best = int(np.argmax(options))
+        if not just_switched[turn] and best != attacker and expected[turn][attacker, defender] * 2 < options[best]:
+            active[turn] = best
+            just_switched[turn] = True
+        else:
+            just_switched[turn] = False
+            move = rng.randrange(team["move_count"][attacker])
+            if rng.uniform(0, 100) <= team["move_accuracy"][attacker, move]:
+                damage = max(1, int(damage_tables[turn][attacker, move, defender] * rng.uniform(0.85, 1.0)))
+                hp[1 - turn][defender] -= damage
+                if hp[1 - turn][defender] <= 0:
+                    if not (hp[1 - turn] > 0).any():
+                        return turn == 0
+                    options = np.where(hp[1 - turn] > 0, expected[1 - turn][:, attacker], -1)
+                    active[1 - turn] = int(np.argmax(options))
+                    # The new Pokemon hasn't switched yet, so it's allowed to switch out on its own turn
+                    just_switched[1 - turn] = False
+        turn = 1 - turn
+
+def get_matchup_scores(candidates_df, meta_df):
+    """
+    Returns an array of shape (len(candidates_df), len(meta_df)) with a rough 0-1 score of how well each
+    candidate does one on one against each meta Pokemon, worked out for the whole roster at once with numpy
+    It guesses each side's damage with the calculate_damage() formula, the same max power that
+    get_level_proportional_moves() uses, and the best type multiplier from get_type_multiplier()
+    (a type1 move gets STAB, a type2 move doesn't), then compares how many hits each side needs
+    """
+    all_types = pd.concat([candidates_df['type1'], candidates_df['type2'], meta_df['type1'], meta_df['type2']])
+    types = sorted(set(all_types.dropna().astype(str).str.lower()))
+    type_numbers = {move_type: number for number, move_type in enumerate(types)}
+    # The last row/column is for a missing type2: it can't attack (0) and doesn't change the damage taken (1)
+    chart = np.ones((len(types) + 1, len(types) + 1))
+    chart[len(types), :] = 0.0
+    for a, attack_type in enumerate(types):
+        for d, defend_type in enumerate(types):
+            chart[a, d] = get_type_multiplier(attack_type, defend_type)
+
+    def get_type_numbers(df, column):
+        names = df[column].fillna("").astype(str).str.lower()
+        return np.array([type_numbers.get(name, len(types)) for name in names])
+
+    def get_damage(attackers, defenders):
+        a1 = get_type_numbers(attackers, 'type1')
+        a2 = get_type_numbers(attackers, 'type2')
+        d1 = get_type_numbers(defenders, 'type1')
+        d2 = get_type_numbers(defenders, 'type2')
+        power = np.maximum(40, (attackers['base_total'].to_numpy() * 0.15).astype(int))
+        base = ((2 * 50 / 5 + 2) * attackers['attack'].to_numpy()[:, None] * power[:, None]
+                / np.maximum(1, defenders['defense'].to_numpy())[None, :]) / 50 + 2
+        type1_mult = 1.5 * chart[a1][:, d1] * chart[a1][:, d2]
+        type2_mult = chart[a2][:, d1] * chart[a2][:, d2]
+        return np.maximum(1, base * np.maximum(type1_mult, type2_mult) * 0.925)
+
+    hits_to_win = np.ceil(meta_df['hp'].to_numpy()[None, :] * 2 / get_damage(candidates_df, meta_df))
+    hits_to_lose = np.ceil(candidates_df['hp'].to_numpy()[:, None] * 2 / get_damage(meta_df, candidates_df).T)
+    ratio = hits_to_lose / hits_to_win
+    return ratio / (1 + ratio)
+
+def prune_candidates(scores, pool_size):
+    """
+    Picks the positions of the candidates worth searching: the best counters to each meta Pokemon first,
+    then the best all-rounders until there are pool_size of them
+    """
+    pool = []
+    counters_each = max(1, pool_size // (2 * scores.shape[1]))
+    for meta in range(scores.shape[1]):
+        for candidate in np.argsort(-scores[:, meta], kind='stable')[:counters_each]:
+            if candidate not in pool:
+                pool.append(int(candidate))
+    for candidate in np.argsort(-scores.mean(axis=1), kind='stable'):
+        if len(pool) >= pool_size:
+            break
+        if candidate not in pool:
+            pool.append(int(candidate))
+    return np.array(pool[:pool_size])
+
+def search_teams(scores, team_size=TEAM_SIZE, beam_width=256, batch_size=64):
+    """
+    Beam search for the teams with the best coverage: a team's value is the average over the meta Pokemon
+    of its best member's score against it, plus a bit of the members' average score to break ties
+    Every step adds one member to each team in the beam. The teams are scored batch_size at a time
+    as one (batch, pool, meta) numpy array instead of one by one
+    Returns the member positions (one sorted row per team) and the values, best team first
+    """
+    pool_size = scores.shape[0]
+    average_scores = scores.mean(axis=1)
+    beam = np.zeros((1, 0), dtype=int)
+    beam_best = np.zeros((1, scores.shape[1]))
+    beam_total = np.zeros(1)
+    values = np.zeros(1)
+    for size in range(1, min(team_size, pool_size) + 1):
+        new_teams = []
+        new_values = []
+        for start in range(0, len(beam), batch_size):
+            members = beam[start:start + batch_size]
+            best = np.maximum(beam_best[start:start + batch_size, None, :], scores[None, :, :])
+            total = beam_total[start:start + batch_size, None] + average_scores[None, :]
+            value = best.mean(axis=2) + 0.1 * total / size
+            # A Pokemon can't be on the same team twice
+            already_in = (members[:, :, None] == np.arange(pool_size)[None, None, :]).any(axis=1)
+            value[already_in] = -np.inf
+            team_numbers, candidates = np.nonzero(np.isfinite(value))
+            new_teams.append(np.sort(np.column_stack([members[team_numbers], candidates]), axis=1))
+            new_values.append(value[team_numbers, candidates])
+        new_teams = np.concatenate(new_teams)
+        new_values = np.concatenate(new_values)
+        # The same team can be reached by adding its members in a different order, so only keep it once
+        new_teams, first = np.unique(new_teams, axis=0, return_index=True)
+        new_values = new_values[first]
+        keep = np.argsort(-new_values, kind='stable')[:beam_width]
+        beam = new_teams[keep]
+        values = new_values[keep]
+        beam_best = scores[beam].max(axis=1)
+        beam_total = average_scores[beam].sum(axis=1)
+    return beam, values
+
+def validate_team(task):
+    """
+    Estimates a team's win rate against the meta team with sequential_win_rate(), drawing new movesets
+    for both teams every battle
+    task is a tuple (team_df, meta_df, moves_df, moves_by_type, seed, precision, max_battles, confidence) so it can be sent
+    to another process. moves_by_type from load_data_store() (or None) is used to pick the moves from the index
+    Every random number comes from random.Random(seed) objects instead of the global random numbers, so
+    teams validated with the same seed face the same meta movesets and battle rolls (common random numbers),
+    which keeps luck from deciding which of two close teams looks better
+    """
+    team_df, meta_df, moves_df, moves_by_type, seed, precision, max_battles, confidence = task
+    team_rng = random.Random(seed)
+    meta_rng = random.Random(seed + 1)
+    battle_rng = random.Random(seed + 2)
+    team = build_team_state(team_df, moves_df, moves_by_type, rng=team_rng)
+    meta = build_team_state(meta_df, moves_df, moves_by_type, rng=meta_rng)
+
+    def play_battle():
+        draw_team_moves(team, team_rng)
+        draw_team_moves(meta, meta_rng)
+        return simulate_team_battle(team, meta, rng=battle_rng)
+
+    return sequential_win_rate(play_battle, precision, max_battles=max_battles, confidence=confidence)
+
+def build_best_team(pokemon_df, meta_df, moves_df, team_size=TEAM_SIZE, pool_size=48, beam_width=256, batch_size=64, n_validate=8, validation_battles=1000, precision=0.075, confidence=0.95, seed=0, n_workers=None, moves_by_type=None):
+    """
+    Searches pokemon_df for the strongest team against the meta team in meta_df
+        1) get_matchup_scores() scores every Pokemon against every meta Pokemon at once
+        2) prune_candidates() keeps only pool_size of them, using those type effectiveness scores
+        3) search_teams() finds the n_validate teams with the best coverage
+        4) validate_team() plays up to validation_battles real team battles for each of those teams against the meta team,
+           all with the same seed, spread over n_workers processes (None uses every core, 1 runs them here without any processes)
+    Each team stops once its interval is within +- precision. With the defaults there are 40 checks, so
+    sequential_win_rate() uses z of about 3.2, and +- 0.075 is reached after about 460 battles for a team
+    that wins half the time and sooner the more lopsided it is, always before the 1000 battle limit
+    A smaller precision needs about (3.2 * 0.5 / precision) ** 2 battles in the worst case, so validation_battles
+    has to go up with it or every team will just run the full validation_battles
+    moves_by_type from load_data_store() can be given so the team movesets come from the index
+    Returns a dictionary with the best team's rows, its win rate and interval, and a dataframe of every validated team
+
+    Documentation for:
+        Running functions in other processes:
+            https://docs.python.org/3/library/concurrent.futures.html#processpoolexecutor
+    """
+    scores = get_matchup_scores(pokemon_df, meta_df)
+    pool = prune_candidates(scores, pool_size)
+    teams, values = search_teams(scores[pool], team_size, beam_width, batch_size)
+    teams = pool[teams[:n_validate]]
+    values = values[:n_validate]
+
+    tasks = [(pokemon_df.iloc[team], meta_df, moves_df, moves_by_type, seed, precision, validation_battles, confidence) for team in teams]
+    if n_workers == 1:
+        results = [validate_team(task) for task in tasks]
+    else:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=n_workers) as executor:
+            results = list(executor.map(validate_team, tasks))
+
+    win_rates = [result["win_rate"] for result in results]
+    candidates = pd.DataFrame({
+        "team": [list(pokemon_df.iloc[team]['name']) for team in teams],
+        "score": values,
+        "win_rate": win_rates,
+        "low": [result["low"] for result in results],
+        "high": [result["high"] for result in results],
+        "battles": [result["battles"] for result in results]
+    }).sort_values('win_rate', ascending=False, kind='stable').reset_index(drop=True)
+    best = int(np.argmax(win_rates))
+    return {
+        "team": pokemon_df.iloc[teams[best]],
+        "win_rate": win_rates[best],
+        "low": results[best]["low"],
+        "high": results[best]["high"],
+        "candidates": candidates
+    }
+
 # Cites documentation for common tkinter features
 def create_battle_window(player_poke, enemy_poke):
     """
@@ -702,6 +1387,88 @@ def test_battle():
         assert mult_normal_rock < 1.0, "Normal vs Rock multiplier should be < 1"
         print("TEST 5 PASSED: Type multipliers behave as expected.")
 
+        # Verify that the early stopping Monte Carlo stops early on a lopsided matchup
+        low, high = wilson_interval(45, 50)
+        assert 0.0 <= low < 0.9 < high <= 1.0, f"Wilson interval invalid: {(low, high)}"
+        mewtwo = find_pokemon_by_name(pokemon_df, "mewtwo")
+        caterpie = find_pokemon_by_name(pokemon_df, "caterpie")
+        matchup = estimate_matchup(mewtwo, caterpie, moves_df, threshold=0.5, max_battles=1000)
+        assert matchup["win_rate"] > 0.5, f"Mewtwo should beat Caterpie: {matchup}"
+        assert matchup["battles"] < 1000, f"Lopsided matchup didn't stop early: {matchup['battles']} battles"
+        print("TEST 6 PASSED: Mewtwo vs Caterpie stopped after", matchup["battles"], "battles, win rate", matchup["win_rate"])
+
+        # Verify that checking after every block doesn't make a 50/50 matchup look decided much more than 5% of the time
+        coin = random.Random(1)
+        false_decisions = sum(sequential_win_rate(lambda: coin.random() < 0.5, threshold=0.5)["stop_reason"] == "decided" for i in range(300))
+        assert false_decisions <= 15, f"50/50 matchup was decided {false_decisions}/300 times"
+        print("TEST 7 PASSED: 50/50 matchup was wrongly decided", false_decisions, "/ 300 times")
+
+        # Verify that the chunked store finds the same Pokemon and picks moves of the right types
+        store = load_data_store(chunksize=100)
+        assert len(store["pokemon"]) == len(pokemon_df), "Chunked store lost some Pokemon"
+        indexed_pikachu = find_pokemon_by_name(store["pokemon"], "PIKACHU", store["pokemon_index"])
+        assert indexed_pikachu['name'] == pikachu['name'], "Indexed lookup found the wrong Pokemon"
+        bulbasaur = find_pokemon_by_name(store["pokemon"], "bulbasaur", store["pokemon_index"])
+        bulba_moves = get_level_proportional_moves(bulbasaur, store["moves"], moves_by_type=store["moves_by_type"])
+        assert len(bulba_moves) == 4, f"Bulbasaur indexed move count invalid: {len(bulba_moves)}"
+        assert set(bulba_moves['type'].str.lower()) <= {"grass", "poison"}, "Indexed moves have the wrong type"
+        indexed_weak, indexed_strong = get_move_pool(bulbasaur, store["moves"], store["moves_by_type"])
+        scanned_weak, scanned_strong = get_move_pool(bulbasaur, moves_df)
+        assert sorted(indexed_weak['name']) == sorted(scanned_weak['name']), "Indexed weak move pool differs from scanning"
+        assert sorted(indexed_strong['name']) == sorted(scanned_strong['name']), "Indexed strong move pool differs from scanning"
+
+        # Same check on a bigger synthetic store, plus making sure a battle's move pool stays the same size however many moves there are
+        with tempfile.TemporaryDirectory() as folder:
+            big_pokemon = os.path.join(folder, "pokemon.csv")
+            big_moves = os.path.join(folder, "moves.csv")
+            generate_synthetic_dataset(50, 50000, big_pokemon, big_moves, seed=2)
+            big_store = load_data_store(big_pokemon, big_moves)
+        big_poke = big_store["pokemon"].iloc[0]
+        indexed_weak, indexed_strong = get_move_pool(big_poke, big_store["moves"], big_store["moves_by_type"])
+        scanned_weak, scanned_strong = get_move_pool(big_poke, big_store["moves"])
+        assert sorted(indexed_weak['name']) == sorted(scanned_weak['name']), "Synthetic indexed weak move pool differs from scanning"
+        assert sorted(indexed_strong['name']) == sorted(scanned_strong['name']), "Synthetic indexed strong move pool differs from scanning"
+        big_pool = get_move_tuple_pool(big_poke, big_store["moves"], big_store["moves_by_type"])
+        assert count_pool_moves(big_pool) == len(indexed_weak) + len(indexed_strong), "Synthetic move pool lost some moves"
+        assert all(group is big_store["moves_by_type"][group["type"]] for group, start, count in big_pool[0] + big_pool[1]), "Move pool copied the index"
+        start_time = time.perf_counter()
+        for i in range(1000):
+            draw_moveset(big_pool)
+        draw_time = time.perf_counter() - start_time
+        assert draw_time < 1.0, f"1000 movesets from a {count_pool_moves(big_pool)} move pool took {draw_time:.2f}s"
+        print("TEST 8 PASSED: Indexed Bulbasaur moves:", list(bulba_moves['name']))
+
+        # Verify that the synthetic dataset generator keeps the same columns
+        with tempfile.TemporaryDirectory() as folder:
+            synthetic_pokemon = os.path.join(folder, "pokemon.csv")
+            synthetic_moves = os.path.join(folder, "moves.csv")
+            generate_synthetic_dataset(250, 300, synthetic_pokemon, synthetic_moves, chunksize=100, seed=1)
+            synthetic_store = load_data_store(synthetic_pokemon, synthetic_moves, chunksize=100)
+        assert list(synthetic_store["pokemon"].columns) == list(pokemon_df.columns), "Synthetic Pokemon columns differ"
+        assert list(synthetic_store["moves"].columns) == list(moves_df.columns), "Synthetic move columns differ"
+        assert len(synthetic_store["pokemon_index"]) == 250, "Synthetic Pokemon names aren't unique"
+        assert len(synthetic_store["moves"]) == 300, "Synthetic move count invalid"
+        print("TEST 9 PASSED: Synthetic dataset generated with", len(synthetic_store["pokemon"]), "Pokemon")
+
+        # Verify that a team battle always finishes and that a full team beats a single Pokemon
+        starters = pokemon_df[pokemon_df['name'].isin(["Bulbasaur", "Charmander", "Squirtle", "Pikachu", "Eevee", "Caterpie"])]
+        starter_team = build_team_state(starters, moves_df)
+        lone_team = build_team_state(pokemon_df[pokemon_df['name'] == "Caterpie"], moves_df)
+        assert starter_team["move_power"].shape == (TEAM_SIZE, MOVES_PER_POKEMON), "Team arrays have the wrong shape"
+        team_wins = sum(simulate_team_battle(starter_team, lone_team) for i in range(20))
+        assert team_wins >= 18, f"Full team only beat a lone Caterpie {team_wins}/20 times"
+        print("TEST 10 PASSED: Starter team beat a lone Caterpie", team_wins, "/ 20 times")
+
+        # Verify that the team builder returns a full team that beats the starters more often than not
+        random_state = random.getstate()
+        best = build_best_team(pokemon_df, starters, moves_df, pool_size=24, beam_width=32, n_validate=2, validation_battles=50, n_workers=1)
+        assert random.getstate() == random_state, "Team builder changed the global random numbers"
+        best_task = (best["team"], starters, store["moves"], store["moves_by_type"], 0, 0.05, 50, 0.95)
+        assert validate_team(best_task) == validate_team(best_task), "Validating the same team with the same seed gave different results"
+        assert len(best["team"]) == TEAM_SIZE, f"Team builder returned {len(best['team'])} Pokemon"
+        assert best["win_rate"] > 0.5, f"Best team only won {best['win_rate']} against the starters"
+        print("TEST 11 PASSED: Best team vs starters:", list(best["team"]['name']), "win rate", best["win_rate"])
+
         print("All tests in test_battle() completed.")
 
     except AssertionError as e: